@@ -26,6 +26,14 @@ Types
 @State = @{Var : bool} # represents a particular program state.
 # Note this does not neccessarily assign to all state variables.
 
+Threading
+----------
+Each PDR instance owns a private z3.Context, and every formula it builds or
+receives lives in that context. Z3 contexts are not thread-safe, but distinct
+contexts can be used from distinct threads concurrently; since z3py calls into
+libz3 via ctypes.CDLL, the GIL is released while the solver is running. Hence
+independent PDR instances can be run in a ThreadPoolExecutor.
+
 References
 ----------
 [1] Een, Niklas, Alan Mishchenko, and Robert Brayton. "Efficient implementation
@@ -36,6 +44,7 @@ of property directed reachability." Formal Methods in Computer-Aided Design
 import z3
 from z3 import Bool, Bools, And, Or, Xor, Implies, Not
 from z3 import Solver, sat, unsat
+import threading
 import logging
 
 __all__ = ['SAFE', 'UNSAFE', 'UNKNOWN', 'is_tautology', 'state_to_cube', 'PDR']
@@ -46,6 +55,10 @@ SAFE = 1
 UNSAFE = 0
 UNKNOWN = -1
 
+## Translating reads the source context, which is typically z3's shared main
+## context. Serialize those reads since a context is not thread-safe.
+_translate_lock = threading.Lock()
+
 def is_tautology(formula) :
     """Check whether the formula is a tautology, and give a counterexample
     if it is not.
@@ -61,37 +74,67 @@ def is_tautology(formula) :
     counterexample@Model - None if the formula is a tautology, otherwise a 
     counterexample.
     """
-    s = Solver()
+    s = Solver(ctx=formula.ctx)
     s.add(Not(formula))
     if s.check() == unsat :
         return True, None
     return False, s.model()
     
-def state_to_cube(state) :
+def state_to_cube(state, ctx=None) :
     """Convert a program state to a cube.
     
     Parameters
     ----------
     state@State - A (possibly partial) program state.
     
+    ctx@z3.Context - The context for the cube. Only needed when the state
+    might be empty; otherwise it is inferred from the state variables.
+    
     Returns
     ----------
     cube@Cube - The cube (conjunction) that fits exactly with the given state.
     """
-    return And([b == v 
-                for b, v in state.items() if v is not None])
+    literals = [b == v for b, v in state.items() if v is not None]
+    if ctx is None :
+        return And(literals)
+    return And(literals, ctx)
 
 class PDR :
     """A implementation of roperty-directed reachability (PDR) algorithm that 
     tries to prove the safety."""
     
-    def __init__(self, bool_pairs) :
-        self.bools = [x for x, xp in bool_pairs]
-        self.boolps = [xp for x, xp in bool_pairs]
+    def __init__(self, bool_pairs, ctx=None) :
+        """
+        Parameters
+        ----------
+        bool_pairs@[(Var, Var)] - Pairs of original and primed state variables,
+        in any context.
+        
+        ctx@z3.Context - The context to work in. A fresh one is created if not
+        given. Do not share a context between threads.
+        """
+        self.ctx = ctx if ctx is not None else z3.Context()
+        self.bools = [self.translate(x) for x, xp in bool_pairs]
+        self.boolps = [self.translate(xp) for x, xp in bool_pairs]
         self.bool_pairs = list(zip(self.bools, self.boolps))
         self.boolp_pairs =  list(zip(self.boolps, self.bools))
 #        self.trans = trans
     
+    def translate(self, formula) :
+        """Copy a formula from any context into the context of this instance.
+        Python booleans are accepted as well."""
+        if isinstance(formula, bool) :
+            return z3.BoolVal(formula, self.ctx)
+        if formula.ctx == self.ctx :
+            return formula
+        with _translate_lock :
+            return formula.translate(self.ctx)
+    
+    def conj(self, *formulas) :
+        """Conjunction of formulas in the context of this instance. Unlike 
+        z3.And, this is safe for an empty list of formulas."""
+        return And(*formulas, self.ctx)
+    
     def to_prime(self, formula) :
         """Convert all original state variables into primed state variables."""
         return z3.substitute(formula, self.bool_pairs)
@@ -127,7 +170,7 @@ class PDR :
         """
         nR = list()
         for c in R :
-            if self.is_implied(And(*R), c, trans)[0] :
+            if self.is_implied(self.conj(*R), c, trans)[0] :
                 nR.append(c)
         return nR
         
@@ -192,8 +235,8 @@ class PDR :
         R0s = Rs[:-1]
         nR0s = R0s
         while True :
-            res, counterexample = (self.is_implied(And(*Rn), post, trans)
-                if level > 0 else is_tautology(Implies(And(*Rn), post)))
+            res, counterexample = (self.is_implied(self.conj(*Rn), post, trans)
+                if level > 0 else is_tautology(Implies(self.conj(*Rn), post)))
             ## refine for $Rn -> post$ if this is the top level
             ## otherwise for $Rn ->_{trans} post$
             logging.debug("back_prop(%d): return from is_implied"%(level))
@@ -201,17 +244,17 @@ class PDR :
             logging.debug("  counterexample=%s"%counterexample)
             if res : break ## exit if the last trace element agree with post
             state_origin = self.get_state_origin(counterexample)            
-            cube = state_to_cube(state_origin)
+            cube = state_to_cube(state_origin, self.ctx)
             Rn = Rn + [(Not(cube))] ## eclude the counterexample from the last trace element
-            check_res, nR0s, ce_seq = self.back_prop(R0s, init, trans, And(*Rn), level+1)
+            check_res, nR0s, ce_seq = self.back_prop(R0s, init, trans, self.conj(*Rn), level+1)
             ## recursively refine back to the rest of trace
             logging.debug("back_prop(%d): return from back_prop"%(level))
             logging.debug("  check_res=%s"%check_res)
             logging.debug("  nR0s=%s"%nR0s)
             logging.debug("  ce_seq=%s"%ce_seq)
             if check_res == UNSAFE : ## violates the initla while recursion
-                cube_prev = state_to_cube(ce_seq[-1])
-                res, counterexample = self.is_implied(cube_prev, And(*Rn), trans)
+                cube_prev = state_to_cube(ce_seq[-1], self.ctx)
+                res, counterexample = self.is_implied(cube_prev, self.conj(*Rn), trans)
                 ## find a counterexample state for the current step
 #                assert not res
                 if level > 0 : ce_seq.append(self.get_state_prime(counterexample))
@@ -244,11 +287,11 @@ class PDR :
             nR = self.induct_naive(R, trans)
 #            nR = list()
 #            for clause in R :
-#                res, ce = self.is_implied(And(*R), clause, trans)
+#                res, ce = self.is_implied(self.conj(*R), clause, trans)
 #                if res : 
 #                    nR.append(clause)
             Rs.append(nR)
-            if is_tautology(And(*R) == And(*nR))[0] :
+            if is_tautology(self.conj(*R) == self.conj(*nR))[0] :
                 break ## when the newly generated trace elements are equivalent
             R = nR
         return Rs
@@ -268,6 +311,9 @@ class PDR :
         
         post -- The postcondition.
         
+        The three formulas may come from any context; they are translated
+        into the context of this instance.
+        
         Returns
         ----------
         check_res -- check_res is SAFE if starting from init will
@@ -278,7 +324,11 @@ class PDR :
         counter_seq -- If check_res is UNSAFE, 
         counter_seq will be a sequence of states beginning in init and ending in 
         ~post(x).
+        
+        Both inv and the states in counter_seq live in the context of this 
+        instance, i.e. self.ctx.
         """
+        init, trans, post = map(self.translate, (init, trans, post))
         Rs = [[]]
         
         ## main loop
@@ -299,5 +349,5 @@ class PDR :
             Rs = self.forward_prop(nRs[0], n + 1, trans)
             logging.debug("pdr: return from forward_prop")
             logging.debug("  Rs=%s"%Rs)
-            if is_tautology(And(*Rs[-1]) == And(*Rs[-2]))[0] :
-                return SAFE, And(*Rs[-1]), None
+            if is_tautology(self.conj(*Rs[-1]) == self.conj(*Rs[-2]))[0] :
+                return SAFE, self.conj(*Rs[-1]), None
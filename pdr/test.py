@@ -9,9 +9,10 @@ import z3
 from z3 import Bool, Bools, And, Or, Xor, Implies, Not
 from pdr import *
 from testcases import test_cases
+from concurrent.futures import ThreadPoolExecutor
 import logging
 
-__all__ = ['test', 'safety_names', 'test_cases']
+__all__ = ['test', 'test_concurrent', 'safety_names', 'test_cases']
 
 safety_names = {
     SAFE : "SAFE",
@@ -19,6 +20,45 @@ safety_names = {
     UNKNOWN : "UNKNOWN",
 }
 
+def translate_state(pdr, state) :
+    """Copy a program state into the context of the given PDR instance."""
+    return dict((pdr.translate(b), v) for b, v in state.items())
+
+def run_case(case) :
+    """Run PDR on a test case and check the results against the expected ones.
+    Each call uses its own z3 context, so it is safe to call from threads.
+    
+    Returns
+    ----------
+    check_res@CheckRes - The checking result.
+    
+    correct@bool - Whether all the results are as expected.
+    """
+    pdr = PDR(case['bool_pairs'])
+    check_res, inv, ce_seq = pdr.pdr(case['init'], case['trans'], case['post'])
+    expected = case['expected_result']
+    correct = check_res == expected.get('check_res')
+    if correct and check_res == SAFE :
+        exp = expected.get('inv')
+        correct = (exp is not None and 
+            is_tautology(Implies(inv, pdr.translate(exp)))[0])
+    if correct and check_res == UNSAFE :
+        exp = expected.get('ce_start')
+        correct = (exp is not None and 
+            is_tautology(Implies(state_to_cube(ce_seq[0], pdr.ctx), 
+                state_to_cube(translate_state(pdr, exp), pdr.ctx)))[0])
+    return check_res, correct
+
+def test_concurrent(case_indices=range(len(test_cases)), max_workers=None) :
+    """Non-interactively run the test cases in a thread pool."""
+    cases = [test_cases[i_case] for i_case in case_indices 
+             if not test_cases[i_case].get('skip')]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor :
+        results = executor.map(run_case, cases)
+        for case, (check_res, correct) in zip(cases, results) :
+            print("%-30s %-8s %s"%(case['name'], safety_names[check_res],
+                "Correct!" if correct else "Unexpected."))
+
 def test(case_indices=range(len(test_cases))) :
     print("start testing..")
     
@@ -63,6 +103,7 @@ def test(case_indices=range(len(test_cases))) :
             print("checking invariant...", end=" ")
             got = z3.simplify(inv)
             exp = case['expected_result'].get('inv')
+            if exp is not None : exp = pdr.translate(exp)
             if exp is not None and is_tautology(Implies(got, exp))[0] :
                 print("Correct!")
             else :
@@ -73,7 +114,8 @@ def test(case_indices=range(len(test_cases))) :
             print("checking counterexample sequence...", end=" ")
             got = ce_seq
             exp = (case['expected_result'].get('ce_start'))
-            if exp is not None and is_tautology(Implies(state_to_cube(ce_seq[0]), state_to_cube(exp)))[0] :
+            if exp is not None : exp = translate_state(pdr, exp)
+            if exp is not None and is_tautology(Implies(state_to_cube(ce_seq[0], pdr.ctx), state_to_cube(exp, pdr.ctx)))[0] :
                 print("Correct!")
             else :
                 print("Unexpected.")
@@ -83,6 +125,10 @@ def test(case_indices=range(len(test_cases))) :
             print("Explanation:", case.get('explanation'))
             
 if __name__ == '__main__' :
-    logging.basicConfig(level=logging.INFO)
-    test()
+    import sys
+    if '--concurrent' in sys.argv[1:] :
+        test_concurrent()
+    else :
+        logging.basicConfig(level=logging.INFO)
+        test()
         
\ No newline at end of file